@@ -1,16 +1,119 @@
 #!/usr/bin/env python3
 """
 駅データのインデックス作成スクリプト
-「位置×文字→駅IDリスト」の辞書を事前計算してJSONファイルに保存
+「位置×文字→駅IDリスト」の辞書を事前計算してバイナリファイルに保存
 """
 
 import pandas as pd
-import json
+import numpy as np
+import orjson
 import jaconv
-from collections import defaultdict
+import hashlib
+import os
+import struct
+import sys
 import time
+import station_data_format
+from station_data_format import INDEX_FILE, DATA_FILE, INDEX_MAGIC, lookup_by_code
 
-def create_station_index(csv_file="station20250604free.csv"):
+# インデックス作成の入力ファイル
+STATION_CSV = "station20250604free.csv"
+ROUTE_CSV = "eki.csv"
+MASTER_DATA_FILE = "master_data.py"  # 都道府県名の対応表
+
+def posting_dtype(station_count):
+    """
+    駅IDを格納する最小の符号なし整数型（リトルエンディアン）を返す
+    
+    Args:
+        station_count: 駅数（駅IDは 0 〜 station_count-1）
+    """
+    return '<u2' if station_count <= 0x10000 else '<u4'
+
+# 文字列列の型（Pythonオブジェクトではなくpyarrowの連続バッファで保持）
+STRING_DTYPE = 'string[pyarrow]'
+
+# 駅データCSVから読み込む列とその型
+STATION_COLUMNS = {
+    'station_cd': 'int32',
+    'station_name': STRING_DTYPE,
+    'line_cd': 'int32',
+    'pref_cd': 'int16'
+}
+
+# (位置, 文字)を1つの整数キー「位置 << CODEPOINT_BITS | コードポイント」に符号化する際のビット数
+# （Unicodeコードポイントの上限 U+10FFFF は21ビットに収まる）
+CODEPOINT_BITS = 21
+CODEPOINT_MASK = (1 << CODEPOINT_BITS) - 1
+
+def encode_key(pos, char):
+    """(位置, 文字)を整数キーに符号化"""
+    return (pos << CODEPOINT_BITS) | ord(char)
+
+def decode_key(key):
+    """整数キーを(位置, 文字)に復号"""
+    return key >> CODEPOINT_BITS, chr(key & CODEPOINT_MASK)
+
+# jaconv.kata2hira の変換対象はすべて U+3000〜U+30FF 内の1文字→1文字の置換のため、
+# この範囲の変換結果をコードポイントの変換表として保持する
+KANA_BLOCK_START = 0x3000
+KANA_BLOCK_SIZE = 0x100
+KATA2HIRA_TABLE = np.frombuffer(
+    jaconv.kata2hira(''.join(map(chr, range(KANA_BLOCK_START, KANA_BLOCK_START + KANA_BLOCK_SIZE)))).encode('utf-32-le'),
+    dtype='<u4'
+)
+# 1文字→1文字の前提が崩れると変換表の位置がずれてインデックスが壊れるため、作成時点で検出する
+if len(KATA2HIRA_TABLE) != KANA_BLOCK_SIZE:
+    raise RuntimeError(
+        f"jaconv.kata2hira の変換結果が想定と異なります（{KANA_BLOCK_SIZE}文字 → {len(KATA2HIRA_TABLE)}文字）"
+    )
+
+def kata2hira_codepoints(codepoints):
+    """
+    コードポイント配列に jaconv.kata2hira と同じ変換を一括で適用
+    
+    Args:
+        codepoints: UTF-32コードポイントの配列
+        
+    Returns:
+        np.ndarray: カタカナをひらがなに置き換えたコードポイントの配列
+    """
+    in_block = (codepoints >= KANA_BLOCK_START) & (codepoints < KANA_BLOCK_START + KANA_BLOCK_SIZE)
+    converted = codepoints.copy()
+    converted[in_block] = KATA2HIRA_TABLE[codepoints[in_block] - KANA_BLOCK_START]
+    return converted
+
+def build_position_index(codepoints, lengths):
+    """
+    駅名のコードポイント配列から「(位置, 文字)→駅IDリスト」の辞書を作成
+    
+    (位置, 文字)を encode_key() と同じ整数キーに符号化し、
+    np.unique でキーごとの件数を数えてから、キー順に並べた1本の駅ID配列を
+    件数ごとに区切って各文字の駅ID配列とする
+    
+    Args:
+        codepoints: 全駅名を連結したUTF-32コードポイントの配列（1文字=1要素）
+        lengths: 駅名ごとの文字数の配列（配列上の行番号を駅IDとする）
+        
+    Returns:
+        dict: {整数キー: 駅IDのndarray（昇順）} キーの昇順（位置→文字の順）に並ぶ
+    """
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    
+    # 各文字の駅IDと駅名内での位置（0始まり）
+    station_ids = np.repeat(np.arange(len(lengths), dtype=posting_dtype(len(lengths))), lengths)
+    positions = np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths)
+    keys = (positions << CODEPOINT_BITS) | codepoints.astype(np.int64)
+    
+    # 1パス目: キーごとの件数を集計
+    unique_keys, counts = np.unique(keys, return_counts=True)
+    # 2パス目: 安定ソートでキー順に並べ替え（同一キー内の駅IDは昇順のまま）
+    sorted_ids = station_ids[np.argsort(keys, kind='stable')]
+    postings = np.split(sorted_ids, np.cumsum(counts)[:-1])
+    
+    return dict(zip(unique_keys.tolist(), postings))
+
+def create_station_index(csv_file=STATION_CSV):
     """
     駅データから位置×文字のインデックスを作成
     
@@ -21,20 +124,24 @@ def create_station_index(csv_file="station20250604free.csv"):
         tuple: (hiragana_index, katakana_index, station_data)
     """
     print(f"駅データを読み込み中: {csv_file}")
-    df = pd.read_csv(csv_file)
-    print(f"データ件数: {len(df):,} 件")
+    # 使用する列のみを型指定で読み込み（型推論と不要列のパースを省略）
+    read_start_time = time.perf_counter()
+    df = pd.read_csv(csv_file, engine='pyarrow', usecols=list(STATION_COLUMNS), dtype=STATION_COLUMNS)
+    print(f"データ件数: {len(df):,} 件 ({time.perf_counter() - read_start_time:.3f}秒)")
     
     # 路線・事業者情報を読み込み
     try:
-        print("路線・事業者データを読み込み中: eki.csv")
-        route_df = pd.read_csv("eki.csv")
-        route_mapping = dict(zip(route_df['路線コード'], route_df['路線名']))
-        operator_mapping = dict(zip(route_df['路線コード'], route_df['事業者']))
+        print(f"路線・事業者データを読み込み中: {ROUTE_CSV}")
+        route_df = pd.read_csv(
+            ROUTE_CSV, engine='pyarrow', usecols=['路線コード', '路線名', '事業者'], dtype={'路線コード': 'int32'}
+        )
+        # 路線コードが重複する場合は後の行を優先
+        route_df = route_df.drop_duplicates('路線コード', keep='last')
         
         # 路線名と事業者名をマッピング
-        df['route_name'] = df['line_cd'].map(route_mapping).fillna("不明")
-        df['operator_name'] = df['line_cd'].map(operator_mapping).fillna("不明")
-        print(f"路線データマッピング完了: {len(route_mapping)} 路線")
+        df['route_name'] = lookup_by_code(df['line_cd'], route_df['路線コード'], route_df['路線名'], "不明")
+        df['operator_name'] = lookup_by_code(df['line_cd'], route_df['路線コード'], route_df['事業者'], "不明")
+        print(f"路線データマッピング完了: {len(route_df)} 路線")
     except Exception as e:
         print(f"⚠️ 路線データ(eki.csv)の読み込みに失敗: {e}")
         df['route_name'] = "不明"
@@ -43,72 +150,178 @@ def create_station_index(csv_file="station20250604free.csv"):
     # 都道府県名を追加（master_dataがある場合）
     try:
         from master_data import PREFECTURE_CODE_TO_NAME
-        df['prefecture'] = df['pref_cd'].map(PREFECTURE_CODE_TO_NAME)
+        df['prefecture'] = lookup_by_code(
+            df['pref_cd'], list(PREFECTURE_CODE_TO_NAME.keys()), list(PREFECTURE_CODE_TO_NAME.values()), np.nan
+        )
         print("都道府県名マッピング完了")
     except Exception as e:
         print(f"⚠️ 都道府県データの読み込みに失敗: {e}")
         # 都道府県コードをそのまま使用
         df['prefecture'] = df['pref_cd'].astype(str) + "番"
     
-    # インデックス初期化
-    hiragana_index = defaultdict(lambda: defaultdict(list))
-    katakana_index = defaultdict(lambda: defaultdict(list))
+    # マッピングで追加した文字列列もpyarrow文字列型に揃える
+    mapped_columns = ['route_name', 'operator_name', 'prefecture']
+    df[mapped_columns] = df[mapped_columns].astype(STRING_DTYPE)
     
     print("インデックス作成中...")
-    start_time = time.time()
+    start_time = time.perf_counter()
     
-    for idx, row in df.iterrows():
-        if idx % 1000 == 0:
-            print(f"処理中: {idx:,} / {len(df):,} ({idx/len(df)*100:.1f}%)")
-        
-        station_name = row['station_name']
-        
-        # ひらがな/漢字用インデックス（カタカナをひらがなに変換）
-        # 駅名全体をひらがなに変換してから、各文字位置でインデックス作成
-        hiragana_name = jaconv.kata2hira(station_name)
-        for pos, char in enumerate(hiragana_name):
-            hiragana_index[pos][char].append(idx)
-        
-        # カタカナ保持用インデックス（変換なし）
-        # 駅名をそのまま使用して、各文字位置でインデックス作成
-        for pos, char in enumerate(station_name):
-            katakana_index[pos][char].append(idx)
+    # 全駅名を連結したUTF-32バッファ（1文字=1要素）と駅名ごとの文字数を一括で取得
+    lengths = df['station_name'].str.len().to_numpy(dtype=np.int64)
+    codepoints = np.frombuffer(
+        ''.join(df['station_name'].to_numpy(dtype=object)).encode('utf-32-le'), dtype='<u4'
+    )
+    # カタカナ→ひらがな変換は駅名ごとではなくコードポイント配列全体に対して一度だけ実施
+    hiragana_codepoints = kata2hira_codepoints(codepoints)
     
-    # defaultdictを通常の辞書に変換
-    hiragana_dict = {pos: dict(chars) for pos, chars in hiragana_index.items()}
-    katakana_dict = {pos: dict(chars) for pos, chars in katakana_index.items()}
+    # ひらがな/漢字用（カタカナをひらがなに変換済み）とカタカナ保持用（変換なし）のインデックスを作成
+    hiragana_dict = build_position_index(hiragana_codepoints, lengths)
+    katakana_dict = build_position_index(codepoints, lengths)
     
-    elapsed_time = time.time() - start_time
-    print(f"インデックス作成完了: {elapsed_time:.2f}秒")
+    elapsed_time = time.perf_counter() - start_time
+    print(f"インデックス作成完了: {elapsed_time:.3f}秒")
     
     # 統計情報
-    total_hiragana_entries = sum(len(chars) for chars in hiragana_dict.values())
-    total_katakana_entries = sum(len(chars) for chars in katakana_dict.values())
-    print(f"ひらがなインデックス: {len(hiragana_dict)} 位置, {total_hiragana_entries} エントリ")
-    print(f"カタカナインデックス: {len(katakana_dict)} 位置, {total_katakana_entries} エントリ")
+    hiragana_positions = len({key >> CODEPOINT_BITS for key in hiragana_dict})
+    katakana_positions = len({key >> CODEPOINT_BITS for key in katakana_dict})
+    print(f"ひらがなインデックス: {hiragana_positions} 位置, {len(hiragana_dict)} エントリ")
+    print(f"カタカナインデックス: {katakana_positions} 位置, {len(katakana_dict)} エントリ")
     
     return hiragana_dict, katakana_dict, df
 
-def save_index_to_files(hiragana_index, katakana_index, df):
+def compute_input_fingerprint(paths):
+    """
+    入力ファイルの更新日時とサイズからフィンガープリントを計算
+    
+    Args:
+        paths: 入力ファイルのパス（存在しないファイルは無視）
+        
+    Returns:
+        str: SHA-256の16進文字列
+    """
+    stats = [
+        f"{path}:{os.path.getmtime(path)}:{os.path.getsize(path)}"
+        for path in paths if os.path.exists(path)
+    ]
+    return hashlib.sha256('|'.join(stats).encode('utf-8')).hexdigest()
+
+def read_index_fingerprint():
+    """
+    保存済みインデックスのヘッダーからフィンガープリントを取得
+    
+    Returns:
+        str or None: フィンガープリント（ファイルがない・読めない場合はNone）
+    """
+    try:
+        with open(INDEX_FILE, 'rb') as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                return None
+            header_length, = struct.unpack('<I', f.read(4))
+            return orjson.loads(f.read(header_length)).get('fingerprint')
+    except (OSError, ValueError, struct.error):
+        return None
+
+def write_posting_lists(f, hiragana_index, katakana_index, station_count, fingerprint=None):
+    """
+    2つのインデックスを「ヘッダー＋駅IDプール」のバイナリ形式でファイルに書き出す
+    
+    ファイル構成:
+        INDEX_MAGIC(4バイト) | ヘッダー長(uint32 LE) | ヘッダー(JSON) | 駅IDプール
+    ヘッダー(JSON)の項目:
+        dtype: 駅IDの整数型（駅数に応じて posting_dtype() が選ぶ '<u2' または '<u4'）
+        fingerprint: インデックス作成時の入力ファイルのフィンガープリント
+        station_count: 駅数（読み込み時に駅データの行数と照合）
+        pool: プール内の各スロットの件数 [件数, ...]
+        hiragana / katakana: {"chars": ..., "positions": ...}
+            chars: インデックスに現れる文字をソートしたリスト（添字が文字番号）
+            positions: 位置を添字とする [[文字番号, ...], [スロット番号, ...]] のリスト
+    内容が同じ駅IDリストはプール内の1スロットにまとめ、両インデックスから共有する
+    スロットはプールに連結した順に並び、開始位置は件数の累積和から復元する（ギャップ符号化）
+    
+    Args:
+        f: バイナリモードで開いた書き込み先ファイル
+        station_count: 駅数（プールの整数型の決定と、読み込み時の駅データとの整合性確認に使用）
+    """
+    postings = []
+    slot_by_content = {}
+    dtype = posting_dtype(station_count)
+    header = {'dtype': dtype, 'fingerprint': fingerprint, 'station_count': station_count, 'pool': []}
+    
+    for name, index in (('hiragana', hiragana_index), ('katakana', katakana_index)):
+        entries = []
+        # 整数キーを復号し、(位置, 文字, スロット番号) の組を1パスで収集
+        for key, station_ids in index.items():
+            pos, char = decode_key(key)
+            station_ids = np.asarray(station_ids, dtype=dtype)
+            content = station_ids.tobytes()
+            if content not in slot_by_content:
+                slot_by_content[content] = len(postings)
+                postings.append(station_ids)
+                header['pool'].append(len(station_ids))
+            entries.append((pos, char, slot_by_content[content]))
+        
+        # 文字に番号を振り、位置ごとに文字番号とスロット番号の並びとして保持
+        chars = sorted({char for _, char, _ in entries})
+        char_to_id = {char: char_id for char_id, char in enumerate(chars)}
+        positions = [[[], []] for _ in range(max((pos for pos, _, _ in entries), default=-1) + 1)]
+        for pos, char, slot in entries:
+            positions[pos][0].append(char_to_id[char])
+            positions[pos][1].append(slot)
+        header[name] = {'chars': chars, 'positions': positions}
+    
+    header_bytes = orjson.dumps(header)
+    # プールの先頭が8バイト境界に揃うよう、ヘッダー末尾を空白で埋める
+    header_bytes += b' ' * (-(len(INDEX_MAGIC) + 4 + len(header_bytes)) % 8)
+    
+    f.write(INDEX_MAGIC)
+    f.write(struct.pack('<I', len(header_bytes)))
+    f.write(header_bytes)
+    # 各スロットの駅ID配列をそのまま書き出し、プール全体を連結したコピーは作らない
+    f.writelines(postings)
+
+def replace_with_temp_file(path, write):
+    """
+    一時ファイルに書き出してから path に置き換える
+    
+    書き出しや置き換えに失敗した場合は一時ファイルを削除し、元のファイルはそのまま残す
+    （Windowsでは他のプロセスが開いているファイルを置き換えられない）
+    
+    Args:
+        path: 出力先のパス
+        write: 書き出し先のパスを受け取って内容を書き出す関数
+    """
+    temp_file = path + '.tmp'
+    try:
+        write(temp_file)
+        os.replace(temp_file, path)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+def save_index_to_files(hiragana_index, katakana_index, df, fingerprint=None):
     """
     インデックスと駅データをファイルに保存
+    
+    Args:
+        fingerprint: 入力ファイルのフィンガープリント（インデックスのヘッダーに記録）
     """
     print("ファイル保存中...")
+    start_time = time.perf_counter()
     
-    # インデックスをJSONで保存
-    with open('station_hiragana_index.json', 'w', encoding='utf-8') as f:
-        json.dump(hiragana_index, f, ensure_ascii=False, separators=(',', ':'))
+    # 駅データをParquetで保存（読み込んだ列と路線・事業者・都道府県名）
+    # フィンガープリント付きのインデックスより先に保存し、途中で失敗した場合は次回に再作成させる
+    replace_with_temp_file(DATA_FILE, lambda path: df.to_parquet(path, index=False, compression='zstd'))
     
-    with open('station_katakana_index.json', 'w', encoding='utf-8') as f:
-        json.dump(katakana_index, f, ensure_ascii=False, separators=(',', ':'))
+    # インデックスをバイナリ形式で保存（ひらがな・カタカナを1ファイルに格納）
+    def write_index(path):
+        with open(path, 'wb') as f:
+            write_posting_lists(f, hiragana_index, katakana_index, len(df), fingerprint)
+    replace_with_temp_file(INDEX_FILE, write_index)
     
-    # 駅データをCSVで保存（全ての列を保持）
-    df.to_csv('station_data_indexed.csv', index=False, encoding='utf-8')
-    
-    print("保存完了:")
-    print("- station_hiragana_index.json")
-    print("- station_katakana_index.json") 
-    print("- station_data_indexed.csv")
+    print(f"保存完了: {time.perf_counter() - start_time:.3f}秒")
+    print(f"- {INDEX_FILE}")
+    print(f"- {DATA_FILE}")
     
     # 保存された列の確認
     print(f"保存された列: {list(df.columns)}")
@@ -137,29 +350,37 @@ def test_index_performance(hiragana_index, katakana_index, df):
     ]
     
     for char, pos in test_queries:
-        start_time = time.time()
+        start_time = time.perf_counter()
         
         # インデックス検索
-        if pos in hiragana_index and char in hiragana_index[pos]:
-            result_count = len(hiragana_index[pos][char])
-        else:
-            result_count = 0
+        station_ids = hiragana_index.get(encode_key(pos, char))
+        result_count = len(station_ids) if station_ids is not None else 0
         
-        elapsed_time = time.time() - start_time
+        elapsed_time = time.perf_counter() - start_time
         print(f"位置{pos}文字目「{char}」: {result_count}件 ({elapsed_time*1000:.3f}ms)")
 
-def main():
+def main(force=False):
     """
     メイン処理
+    
+    Args:
+        force: Trueの場合、入力ファイルに変更がなくてもインデックスを再作成
     """
     print("=== 駅データインデックス作成ツール ===")
     
     try:
+        # 入力ファイル（とこのスクリプト・ファイル形式の定義）に変更がなければ再作成をスキップ
+        fingerprint = compute_input_fingerprint([STATION_CSV, ROUTE_CSV, MASTER_DATA_FILE, __file__, station_data_format.__file__])
+        if not force and os.path.exists(DATA_FILE) and read_index_fingerprint() == fingerprint:
+            print("入力ファイルに変更がないため、インデックスの再作成をスキップしました")
+            print("強制的に再作成する場合は --force を指定してください。")
+            return 0
+        
         # インデックス作成
-        hiragana_index, katakana_index, df = create_station_index()
+        hiragana_index, katakana_index, df = create_station_index(STATION_CSV)
         
         # ファイル保存
-        save_index_to_files(hiragana_index, katakana_index, df)
+        save_index_to_files(hiragana_index, katakana_index, df, fingerprint)
         
         # 性能テスト
         test_index_performance(hiragana_index, katakana_index, df)
@@ -174,4 +395,4 @@ def main():
     return 0
 
 if __name__ == "__main__":
-    exit(main())
+    exit(main(force='--force' in sys.argv[1:]))
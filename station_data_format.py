@@ -0,0 +1,31 @@
+"""
+create_index.py と station_search_gui.py で共有する事前計算ファイルの形式と補助関数
+"""
+
+import pandas as pd
+import numpy as np
+
+# 事前計算インデックスの出力先と形式
+INDEX_FILE = 'station_index.bin'
+DATA_FILE = 'station_data_indexed.parquet'
+INDEX_MAGIC = b'STIX'
+
+def lookup_by_code(codes, keys, values, default):
+    """
+    コード列に対応する値を一括で引き当てる
+    
+    辞書の行ごとの参照ではなく、pd.Categorical のコード（keys内の位置）で
+    values配列を直接インデックス参照する
+    
+    Args:
+        codes: 引き当てるコード列
+        keys: コードの一覧（重複なし）
+        values: keysと同じ並びの値
+        default: keysに存在しないコードに割り当てる値
+        
+    Returns:
+        np.ndarray: codesと同じ長さの値の配列
+    """
+    positions = pd.Categorical(codes, categories=keys).codes
+    found = np.asarray(values, dtype=object)[positions.clip(min=0)]
+    return np.where(positions >= 0, found, default)
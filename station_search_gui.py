@@ -1,49 +1,138 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow.parquet as pq
 import json
 import re
+import struct
 import jaconv
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, NamedTuple, Sequence, Tuple, Optional
 import io
 import os
 from master_data import LINE_MAPPING, OPERATOR_MAPPING, REGION_MAPPING, PREFECTURE_CODE_TO_NAME
+from station_data_format import INDEX_FILE, DATA_FILE, INDEX_MAGIC, lookup_by_code
 
 
-@st.cache_data
+# 検索・表示で使用する駅データの列（DATA_FILE からはこれらの列のみ読み込む）
+DATA_COLUMNS = ['station_name', 'pref_cd', 'prefecture', 'route_name', 'operator_name']
+
+# 検索文字列の正規化で取り除く文字（ひらがな・カタカナ・漢字以外／ひらがな・漢字以外）
+NON_KANA_KANJI_PATTERN = re.compile(r'[^ぁ-んァ-ヾー一-龯]')
+NON_HIRAGANA_KANJI_PATTERN = re.compile(r'[^ぁ-んー一-龯]')
+
+# 検索結果キャッシュの上限（全セッション共通の件数と保持時間。古いものから破棄）
+SEARCH_CACHE_MAX_ENTRIES = 256
+SEARCH_CACHE_TTL_SECONDS = 60 * 60
+
+# 検索結果の列（表示順）
+RESULT_COLUMNS = [
+    'station_name', 'prefecture', 'operator_name', 'route_name',
+    'search_char', 'char_position', 'search_scope'
+]
+
+# 検索範囲の表示ラベル（選択地域内なら1、それ以外は0のカテゴリ番号に対応）
+SEARCH_SCOPE_LABELS = ['🔴 全国', '🔵 選択地域内']
+
+
+def search_scope_labels(in_selected: np.ndarray) -> pd.Categorical:
+    """
+    選択地域内かどうかのブール配列から検索範囲の表示ラベルを作成
+    
+    Args:
+        in_selected: 各駅が選択地域内かどうかのブール配列
+    
+    Returns:
+        pd.Categorical: '🔵 選択地域内' / '🔴 全国' のカテゴリ配列
+    """
+    return pd.Categorical.from_codes(np.asarray(in_selected).astype(np.int8), categories=SEARCH_SCOPE_LABELS)
+
+
+class PositionIndex(NamedTuple):
+    """位置×文字のインデックス（文字は char_to_id で文字番号に変換して postings を参照）"""
+    char_to_id: Dict[str, int]
+    postings: np.ndarray  # 形状 (位置数, 文字数) のobject配列。値は駅IDのndarray（該当なしは None）
+    present: np.ndarray  # postings と同じ形状のブール配列（該当する駅があれば True）
+
+
+def unpack_posting_lists(data) -> Tuple[PositionIndex, PositionIndex, Optional[int]]:
+    """
+    create_index.py が出力したバイナリ形式のインデックスを展開
+    
+    Args:
+        data: インデックスファイルの内容（bytes）
+    
+    Returns:
+        tuple: (hiragana_index, katakana_index, station_count)
+            インデックスは PositionIndex、station_count はインデックス作成時の駅数
+    """
+    if data[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+        raise ValueError(f"{INDEX_FILE} の形式が正しくありません")
+    
+    header_start = len(INDEX_MAGIC) + 4
+    header_length, = struct.unpack_from('<I', data, len(INDEX_MAGIC))
+    header = json.loads(data[header_start:header_start + header_length])
+    
+    # 駅IDプールはコピーせずにndarrayとして参照し、各文字の駅IDはそのスライスを使う
+    pool = np.frombuffer(data, dtype=header['dtype'], offset=header_start + header_length)
+    
+    # ヘッダーには各スロットの件数のみが並ぶため、累積和からプール内の範囲を復元
+    lengths = np.array(header['pool'], dtype=np.int64)
+    ends = np.cumsum(lengths)
+    slots = np.empty(len(lengths), dtype=object)
+    slots[:] = [pool[start:end] for start, end in zip((ends - lengths).tolist(), ends.tolist())]
+    
+    # 両インデックスとも、内容が同じ駅IDリストは同じスロット（ビュー）を参照する
+    # 文字番号はヘッダーに保存済みのため、位置×文字番号の2次元配列に直接配置する
+    def expand(table):
+        shape = (len(table['positions']), len(table['chars']))
+        postings = np.full(shape, None, dtype=object)
+        present = np.zeros(shape, dtype=bool)
+        for pos, (char_ids, slot_numbers) in enumerate(table['positions']):
+            postings[pos, char_ids] = slots[slot_numbers]
+            present[pos, char_ids] = True
+        return PositionIndex({char: char_id for char_id, char in enumerate(table['chars'])}, postings, present)
+    
+    return expand(header['hiragana']), expand(header['katakana']), header.get('station_count')
+
+
+@st.cache_resource
 def load_precomputed_index():
     """
     事前計算されたインデックスファイルを読み込み
     
+    インデックスと駅データはセッション間で共有されるため（コピーされない）、
+    呼び出し側で変更しないこと
+    
     Returns:
-        tuple: (hiragana_index, katakana_i                    # 検索範囲を決定
-                    station_pref_cd = station_data.get('pref_cd', 0)
-                    if selected_prefecture_codes and station_pref_cd in selected_prefecture_codes:
-                        search_scope = '🔵 選択地域内'
-                    else:
-                        search_scope = '🔴 全国'df) or (None, None, None)
+        tuple: (hiragana_index, katakana_index, df) or (None, None, None)
     """
     try:
         # インデックスファイルの存在確認
-        hiragana_file = 'station_hiragana_index.json'
-        katakana_file = 'station_katakana_index.json'
-        data_file = 'station_data_indexed.csv'
-        
-        if not all(os.path.exists(f) for f in [hiragana_file, katakana_file, data_file]):
+        if not all(os.path.exists(f) for f in [INDEX_FILE, DATA_FILE]):
             return None, None, None
         
-        # インデックス読み込み
-        with open(hiragana_file, 'r', encoding='utf-8') as f:
-            hiragana_index = json.load(f)
+        # インデックス読み込み（駅IDは読み込んだバイト列上のビューとして参照）
+        # ファイルを開いたままにしないため、アプリ実行中でも create_index.py で置き換えられる
+        with open(INDEX_FILE, 'rb') as f:
+            index_data = f.read()
+        hiragana_index, katakana_index, station_count = unpack_posting_lists(index_data)
         
-        with open(katakana_file, 'r', encoding='utf-8') as f:
-            katakana_index = json.load(f)
-        
-        # 駅データ読み込み
-        df = pd.read_csv(data_file)
+        # 駅データ読み込み（使用する列のみを読み込み、不足している列は補完）
+        available_columns = set(pq.read_schema(DATA_FILE).names)
+        df = pd.read_parquet(DATA_FILE, columns=[col for col in DATA_COLUMNS if col in available_columns])
+        if 'prefecture' not in df.columns:
+            df['prefecture'] = df['pref_cd'].map(PREFECTURE_CODE_TO_NAME)
+        if 'route_name' not in df.columns:
+            df['route_name'] = "不明"
+        if 'operator_name' not in df.columns:
+            df['operator_name'] = "不明"
         
-        # キーを整数に変換（JSONは文字列キーになるため）
-        hiragana_index = {int(k): v for k, v in hiragana_index.items()}
-        katakana_index = {int(k): v for k, v in katakana_index.items()}
+        # 駅IDは駅データの行番号のため、別々に作成された2ファイルの組み合わせは使わない
+        if station_count != len(df):
+            raise ValueError(
+                f"{INDEX_FILE} と {DATA_FILE} の駅数が一致しません（{station_count} / {len(df)}）。"
+                "create_index.py を再実行してください"
+            )
         
         return hiragana_index, katakana_index, df
         
@@ -52,50 +141,6 @@ def load_precomputed_index():
         return None, None, None
 
 
-def find_stations_by_index(station_index: Dict, char: str, position: int, df: pd.DataFrame) -> List[Dict]:
-    """
-    インデックスを使用した高速駅検索
-    
-    Args:
-        station_index: 事前作成されたインデックス
-        char: 検索文字
-        position: 位置
-        df: 駅データ
-    
-    Returns:
-        該当する駅の辞書リスト
-    """
-    if position not in station_index or char not in station_index[position]:
-        return []
-    
-    # インデックスから駅IDを取得し、対応する駅データを返す
-    station_indices = station_index[position][char]
-    matching_stations = []
-    
-    for idx in station_indices:
-        if idx < len(df):
-            station_data = df.iloc[idx].to_dict()
-            
-            # 実際の駅名から該当位置の文字を取得して検証
-            station_name = station_data.get('station_name', '')
-            if position < len(station_name):
-                # 実際の駅名の指定位置の文字を取得
-                actual_char_at_position = station_name[position]
-                
-                # インデックスが正しく動作しているか確認（デバッグ用）
-                # この文字が検索文字と一致するかチェック
-                normalized_actual = jaconv.kata2hira(actual_char_at_position)
-                normalized_search = jaconv.kata2hira(char)
-                
-                if normalized_actual == normalized_search:
-                    station_data['actual_char'] = actual_char_at_position
-                    matching_stations.append(station_data)
-            # position >= len(station_name)の場合はスキップ（インデックスエラーの可能性）
-    
-    return matching_stations
-
-
-
 def get_prefecture_options():
     """都道府県とその地方区分のオプションを取得（都道府県コード順）"""
     options = []
@@ -110,24 +155,24 @@ def get_prefecture_options():
     
     return options
 
-def get_selected_prefecture_codes(selected_options):
-    """選択されたオプションから都道府県コードのリストを取得"""
-    pref_codes = []
+# 地方・都道府県の選択肢と都道府県名→コードの対応は固定のため、起動時に一度だけ作成
+PREFECTURE_OPTIONS = get_prefecture_options()
+NAME_TO_CODE = {name: code for code, name in PREFECTURE_CODE_TO_NAME.items()}
+
+def get_selected_prefecture_codes(selected_options) -> Tuple[int, ...]:
+    """選択されたオプションから都道府県コードを取得（重複を除いたソート済みのタプル）"""
+    pref_codes = set()
     
     for option in selected_options:
         if option.startswith("【") and option.endswith("】"):
             # 地方区分の場合
             region_name = option[1:-1]  # 【】を除去
-            if region_name in REGION_MAPPING:
-                pref_codes.extend(REGION_MAPPING[region_name])
-        else:
+            pref_codes.update(REGION_MAPPING.get(region_name, []))
+        elif option in NAME_TO_CODE:
             # 個別都道府県の場合
-            for code, name in PREFECTURE_CODE_TO_NAME.items():
-                if name == option:
-                    pref_codes.append(code)
-                    break
+            pref_codes.add(NAME_TO_CODE[option])
     
-    return list(set(pref_codes))  # 重複排除
+    return tuple(sorted(pref_codes))
 
 
 def load_station_data(csv_file=None) -> pd.DataFrame:
@@ -151,15 +196,20 @@ def load_station_data(csv_file=None) -> pd.DataFrame:
         # 都道府県名を追加
         df['prefecture'] = df['pref_cd'].map(PREFECTURE_CODE_TO_NAME)
         
+        # 検索用にカタカナをひらがなに変換した駅名を一度だけ作成
+        df['station_name_hira'] = df['station_name'].map(jaconv.kata2hira)
+        
         # 路線情報を読み込み
         try:
-            route_df = pd.read_csv("eki.csv")
-            route_mapping = dict(zip(route_df['路線コード'], route_df['路線名']))
-            operator_mapping = dict(zip(route_df['路線コード'], route_df['事業者']))
+            route_df = pd.read_csv(
+                "eki.csv", engine='pyarrow', usecols=['路線コード', '路線名', '事業者'], dtype={'路線コード': 'int32'}
+            )
+            # 路線コードが重複する場合は後の行を優先
+            route_df = route_df.drop_duplicates('路線コード', keep='last')
             
-            # 路線名と事業者名をマッピング
-            df['route_name'] = df['line_cd'].map(route_mapping).fillna("不明")
-            df['operator_name'] = df['line_cd'].map(operator_mapping).fillna("不明")
+            # 路線名と事業者名をマッピング（辞書を作らずコード位置で一括参照）
+            df['route_name'] = lookup_by_code(df['line_cd'], route_df['路線コード'], route_df['路線名'], "不明")
+            df['operator_name'] = lookup_by_code(df['line_cd'], route_df['路線コード'], route_df['事業者'], "不明")
         except Exception as e:
             st.warning(f"路線データ(eki.csv)の読み込みに失敗しました: {e}")
             df['route_name'] = "不明"
@@ -185,12 +235,12 @@ def normalize_search_string(text: str, include_katakana: bool = False) -> str:
     
     if include_katakana:
         # カタカナも保持する場合：ひらがな、カタカナ、漢字を保持
-        text = re.sub(r'[^ぁ-んァ-ヾー一-龯]', '', text)
+        text = NON_KANA_KANJI_PATTERN.sub('', text)
     else:
         # カタカナをひらがなに変換
         text = jaconv.kata2hira(text)
         # ひらがなと漢字のみを保持
-        text = re.sub(r'[^ぁ-んー一-龯]', '', text)
+        text = NON_HIRAGANA_KANJI_PATTERN.sub('', text)
     
     # 最大20文字に制限
     return text[:20]
@@ -206,31 +256,22 @@ def find_character_positions_cross(df: pd.DataFrame, search_string: str, include
     # 検索文字列の各文字について、その文字を含む駅を位置別に分類
     char_positions = {}
     
+    # 駅×位置の文字配列は検索対象の列ごとに一度だけ作成
+    char_matrices = {}
+    
     for char_index, char in enumerate(search_string):
         char_positions[char_index] = {}  # 位置別の駅リスト
         
-        for _, row in df.iterrows():
-            station_name = row['station_name']
-            
-            # 検索対象の決定
-            if include_katakana:
-                # カタカナも保持する場合：文字変換を行わない
-                search_target = station_name
-            else:
-                # カタカナをひらがなに変換する場合
-                if re.match(r'[ぁ-んー]', char):
-                    # ひらがな検索
-                    search_target = jaconv.kata2hira(station_name)
-                else:
-                    # 漢字検索
-                    search_target = station_name
-            
-            # 文字の位置をすべて取得
-            for pos in range(len(search_target)):
-                if pos < len(search_target) and search_target[pos] == char:
-                    if pos not in char_positions[char_index]:
-                        char_positions[char_index][pos] = []
-                    char_positions[char_index][pos].append(row.to_dict())
+        # 検索対象の決定（カタカナを区別しない場合のひらがな検索のみ、ひらがな変換済みの駅名を使用）
+        is_hiragana = 'ぁ' <= char <= 'ん' or char == 'ー'
+        search_target = 'station_name_hira' if is_hiragana and not include_katakana else 'station_name'
+        if search_target not in char_matrices:
+            char_matrices[search_target] = build_char_matrix(df[search_target])
+        
+        # 文字の位置をすべて取得（駅×位置の文字配列を一括比較）
+        rows, positions = np.nonzero(char_matrices[search_target] == char)
+        for pos in np.unique(positions):
+            char_positions[char_index][int(pos)] = df.iloc[rows[positions == pos]].to_dict('records')
     
     # 全文字が同じ位置で見つかる組み合わせを探す
     cross_possible = False
@@ -268,15 +309,27 @@ def find_character_positions_cross(df: pd.DataFrame, search_string: str, include
     }
 
 
-def find_character_positions_cross_with_priority(df_all: pd.DataFrame, df_selected: pd.DataFrame, search_string: str, include_katakana: bool = False) -> Dict:
+def find_character_positions_cross_with_priority(df: pd.DataFrame, selected_mask: np.ndarray, search_string: str, include_katakana: bool = False) -> Dict:
     """
     文字別優先検索を行う縦クロスワード検索関数
     各文字について、選択地域内の駅を優先的に使用し、なければ全国から選択
     該当する全ての駅を返す（全ての位置での組み合わせ）
+    
+    Args:
+        df: 全国の駅データ
+        selected_mask: 各駅が選択地域内かどうかのブール配列（df の行順）
+        search_string: 正規化済みの検索文字列
+        include_katakana: カタカナを区別するか
     """
     if not search_string:
         return {"cross_possible": False, "position_groups": {}, "matching_stations": []}
     
+    # 駅×位置の文字配列は検索ごとに一度だけ作成し、全位置・全文字で使い回す
+    # （カタカナ区別の有無で対象列が変わるうえ、この経路の駅データは再実行のたびに
+    # load_station_data で読み込み直されるため、読み込み時に作っても作成回数は減らない）
+    target_column = 'station_name' if include_katakana else 'station_name_hira'
+    char_matrix = build_char_matrix(df[target_column])
+    
     all_position_results = []
     
     # 各位置について、全文字が揃うかチェック（全位置を調べる）
@@ -285,22 +338,8 @@ def find_character_positions_cross_with_priority(df_all: pd.DataFrame, df_select
         all_chars_found = True
         
         for char_index, char in enumerate(search_string):
-            char_stations = []
-            
-            # まず選択地域内で探す（全ての該当駅）
-            if not df_selected.empty:
-                selected_stations = find_all_chars_at_position(df_selected, char, pos, include_katakana)
-                char_stations.extend(selected_stations)
-            
-            # 選択地域外も含めて全国で探す（重複は後で除去）
-            all_stations = find_all_chars_at_position(df_all, char, pos, include_katakana)
-            
-            # 重複を除去しつつ追加（station_nameとpref_cdで判定）
-            existing_keys = {(s['station_name'], s.get('pref_cd', 0)) for s in char_stations}
-            for station in all_stations:
-                key = (station['station_name'], station.get('pref_cd', 0))
-                if key not in existing_keys:
-                    char_stations.append(station)
+            # 全国を1回だけ走査し、選択地域内の駅を先頭に並べる
+            char_stations = find_all_chars_at_position(df, char, pos, include_katakana, char_matrix, selected_mask)
             
             if char_stations:
                 all_matching_stations.append((char, char_stations))
@@ -326,41 +365,62 @@ def find_character_positions_cross_with_priority(df_all: pd.DataFrame, df_select
     return {"cross_possible": False, "position_groups": {}, "matching_stations": []}
 
 
-def find_all_chars_at_position(df: pd.DataFrame, char: str, position: int, include_katakana: bool = False) -> List[Dict]:
+def build_char_matrix(names: pd.Series) -> np.ndarray:
+    """
+    駅名の列を「駅×文字位置」の1文字単位の配列に変換
+    
+    固定長Unicode配列を1文字ずつのビューとして並べ直すため、
+    指定位置の文字比較が全駅まとめて一度で行える
+    
+    Args:
+        names: 駅名の列
+    
+    Returns:
+        np.ndarray: 形状 (駅数, 最大駅名長) の '<U1' 配列（駅名より後ろの位置は空文字）
+    """
+    names = names.fillna('')
+    width = max(int(names.str.len().max()), 1) if len(names) else 1
+    return names.to_numpy(dtype=f'<U{width}').view('<U1').reshape(len(names), width)
+
+
+def find_all_chars_at_position(df: pd.DataFrame, char: str, position: int, include_katakana: bool = False, char_matrix: Optional[np.ndarray] = None, selected_mask: Optional[np.ndarray] = None) -> List[Dict]:
     """
     指定された位置に指定された文字を持つ全ての駅を探す
     対応文字は元の駅名から取得する
+    
+    Args:
+        df: 駅データ
+        char: 検索文字（normalize_search_string で正規化済みのもの）
+        position: 文字位置
+        include_katakana: カタカナを区別するか
+        char_matrix: df の検索対象列から作成済みの build_char_matrix の結果（省略時はここで作成）
+        selected_mask: 各駅が選択地域内かどうかのブール配列。指定時は選択地域内の駅を先頭に並べ、
+            各駅に search_scope を付与する
     """
-    matching_stations = []
+    # 検索対象の決定（ひらがなモードではカタカナをひらがなに変換済みの駅名列を使用）
+    if char_matrix is None:
+        char_matrix = build_char_matrix(df['station_name' if include_katakana else 'station_name_hira'])
+    if position >= char_matrix.shape[1]:
+        return []
     
-    for _, row in df.iterrows():
-        station_name = row['station_name']
-        
-        # 検索対象の決定
-        if include_katakana:
-            # カタカナも保持する場合：文字変換を行わない
-            search_target = station_name
-            search_char_normalized = char
-        else:
-            # カタカナをひらがなに変換する場合
-            search_target = jaconv.kata2hira(station_name)
-            search_char_normalized = jaconv.kata2hira(char)
-        
-        # 指定位置に指定文字があるかチェック
-        if position < len(search_target) and search_target[position] == search_char_normalized:
-            # 結果データに元の駅名の文字を追加
-            station_dict = row.to_dict()
-            # 対応文字は元の駅名から取得（カタカナならカタカナのまま）
-            if position < len(station_name):
-                station_dict['actual_char'] = station_name[position]
-            else:
-                station_dict['actual_char'] = char
-            matching_stations.append(station_dict)
+    # 指定位置に指定文字がある駅を一括で抽出
+    indices = np.flatnonzero(char_matrix[:, position] == char)
+    if selected_mask is not None:
+        # 選択地域内の駅を先に、それ以外を後に（それぞれ元の並び順のまま）
+        in_selected = selected_mask[indices]
+        indices = np.concatenate([indices[in_selected], indices[~in_selected]])
+    matches = df.iloc[indices]
+    
+    # 対応文字は元の駅名から取得（カタカナならカタカナのまま）し、列として付与してから一括で辞書化
+    extra_columns = {'actual_char': matches['station_name'].str.get(position)}
+    if selected_mask is not None:
+        extra_columns['search_scope'] = search_scope_labels(selected_mask[indices])
+    matching_stations = matches.assign(**extra_columns).to_dict('records')
     
     return matching_stations
 
 
-def search_and_analyze_fast(df: pd.DataFrame, search_string: str, selected_prefecture_codes: List[int], hiragana_index: Dict, katakana_index: Dict, include_katakana: bool = False) -> pd.DataFrame:
+def search_and_analyze_fast(df: pd.DataFrame, search_string: str, selected_prefecture_codes: Sequence[int], hiragana_index: PositionIndex, katakana_index: PositionIndex, include_katakana: bool = False) -> pd.DataFrame:
     """
     インデックスを使用した高速縦クロスワード検索と分析
     """
@@ -376,62 +436,64 @@ def search_and_analyze_fast(df: pd.DataFrame, search_string: str, selected_prefe
     # 使用するインデックスを選択
     station_index = katakana_index if include_katakana else hiragana_index
     
-    result_rows = []
+    # 正規化済みの検索文字列はインデックスのキーと同じ表記（ひらがなモードではひらがな）
+    search_chars = normalized_search
     
-    # 各位置について、縦クロスワードの可能性をチェック
-    for pos in range(20):  # 最大20文字の駅名を想定
-        # 各文字ごとに該当する駅のリストを取得
-        char_station_lists = []
-        
-        for char_index, char in enumerate(normalized_search):
-            # 検索文字を適切に正規化
-            if include_katakana:
-                search_char = char  # カタカナモードでは変換しない
-            else:
-                search_char = jaconv.kata2hira(char)  # ひらがなモードではひらがなに変換
-            
-            # この位置にこの文字を持つ駅を探す
-            char_stations = find_stations_by_index(station_index, search_char, pos, df)
-            
-            # この文字に対応する駅がない場合は、この位置では縦クロスワード不可能
-            if not char_stations:
-                break
-                
-            char_station_lists.append(char_stations)
-        
-        # 全ての文字で駅が見つかった場合のみ結果に追加
-        if len(char_station_lists) == len(normalized_search):
-            # 各文字ごとに駅を結果に追加
-            for char_index, stations_for_char in enumerate(char_station_lists):
-                for station_data in stations_for_char:
-                    # 検索範囲を決定
-                    station_pref_cd = station_data.get('pref_cd', 0)
-                    if selected_prefecture_codes and station_pref_cd in selected_prefecture_codes:
-                        search_scope = '🔵 選択地域内'
-                    else:
-                        search_scope = '🔴 全国'
-                    
-                    # 対応文字は元の駅名から実際に取得
-                    station_name = station_data.get('station_name', '')
-                    if pos < len(station_name):
-                        actual_char = station_name[pos]
-                    else:
-                        actual_char = normalized_search[char_index]
-                    
-                    result_rows.append({
-                        'station_name': station_data['station_name'],
-                        'prefecture': station_data.get('prefecture', '不明'),
-                        'operator_name': station_data.get('operator_name', '不明'),
-                        'route_name': station_data.get('route_name', '不明'),
-                        'search_char': actual_char,
-                        'char_position': pos + 1,  # 1ベースに変換
-                        'search_scope': search_scope
-                    })
-    
-    return pd.DataFrame(result_rows)
-
-
-def search_and_analyze(df: pd.DataFrame, search_string: str, selected_prefecture_codes: List[int], include_katakana: bool = False) -> pd.DataFrame:
+    # どの駅名にも現れない文字が含まれる場合は、位置を調べるまでもなく該当なし
+    if not all(char in station_index.char_to_id for char in search_chars):
+        return pd.DataFrame()
+    
+    # 全ての検索文字がインデックスに存在する位置だけを残す（駅データの参照前に、
+    # 位置×検索文字の有無の表を文字方向にANDして一括で判定）
+    char_ids = [station_index.char_to_id[char] for char in search_chars]
+    present = station_index.present[:20, char_ids]  # 最大20文字の駅名を想定
+    surviving_positions = np.flatnonzero(present.all(axis=1)).tolist()
+    if not surviving_positions:
+        return pd.DataFrame()
+    
+    # 結果の各行を「駅ID・文字位置」の配列として連結（位置順、位置内は検索文字順）
+    posting_lists = [
+        (station_index.postings[pos, char_id], pos)
+        for pos in surviving_positions for char_id in char_ids
+    ]
+    row_ids = np.concatenate([station_ids for station_ids, _ in posting_lists]).astype(np.intp)
+    row_positions = np.concatenate([np.full(len(station_ids), pos) for station_ids, pos in posting_lists])
+    
+    # 駅データは結果の行だけを一括で取り出し、列ごとに結果を作成
+    matches = df.iloc[row_ids]
+    in_selected = np.isin(matches['pref_cd'].to_numpy(), np.asarray(selected_prefecture_codes, dtype=np.int32))
+    return pd.DataFrame({
+        'station_name': matches['station_name'].to_numpy(),
+        'prefecture': matches['prefecture'].to_numpy(),
+        'operator_name': matches['operator_name'].to_numpy(),
+        'route_name': matches['route_name'].to_numpy(),
+        # 対応文字は元の駅名の該当位置の文字（カタカナならカタカナのまま）
+        'search_char': build_char_matrix(matches['station_name'])[np.arange(len(matches)), row_positions],
+        'char_position': row_positions + 1,  # 1ベースに変換
+        'search_scope': search_scope_labels(in_selected)
+    }, columns=RESULT_COLUMNS)
+
+
+@st.cache_data(show_spinner=False, max_entries=SEARCH_CACHE_MAX_ENTRIES, ttl=SEARCH_CACHE_TTL_SECONDS)
+def search_and_analyze_cached(normalized_search: str, selected_prefecture_codes: Tuple[int, ...], include_katakana: bool = False) -> pd.DataFrame:
+    """
+    事前計算インデックスを使った検索結果を検索条件ごとにキャッシュ
+    
+    インデックスと駅データは load_precomputed_index（共有リソース）から取得するため、
+    キャッシュキーには検索条件のみが使われる
+    
+    Args:
+        normalized_search: normalize_search_string で正規化済みの検索文字列
+        selected_prefecture_codes: 選択地域の都道府県コード（ソート済みのタプル）
+        include_katakana: カタカナを区別するか
+    """
+    hiragana_index, katakana_index, df = load_precomputed_index()
+    if hiragana_index is None:
+        return pd.DataFrame()
+    return search_and_analyze_fast(df, normalized_search, selected_prefecture_codes, hiragana_index, katakana_index, include_katakana)
+
+
+def search_and_analyze(df: pd.DataFrame, search_string: str, selected_prefecture_codes: Sequence[int], include_katakana: bool = False) -> pd.DataFrame:
     """
     複数駅名を使った縦クロスワード検索と分析（文字別優先順位付き）
     """
@@ -445,46 +507,38 @@ def search_and_analyze(df: pd.DataFrame, search_string: str, selected_prefecture
         # 検索文字列が空の場合は空を返す
         return pd.DataFrame()
     
-    # 選択地域のデータと全国データを準備
-    if selected_prefecture_codes:
-        df_selected = df[df['pref_cd'].isin(selected_prefecture_codes)].copy()
-    else:
-        df_selected = pd.DataFrame()
+    # どの駅名にも現れない文字が含まれる場合は、位置を調べるまでもなく該当なし
+    target_column = 'station_name' if include_katakana else 'station_name_hira'
+    if not set(normalized_search) <= set(df[target_column].str.cat()):
+        return pd.DataFrame()
+    
+    # 各駅が選択地域内かどうかを一度だけ判定（以降の検索範囲の判定はすべてこのマスクを参照）
+    selected_mask = np.isin(df['pref_cd'].to_numpy(), np.asarray(selected_prefecture_codes, dtype=np.int32))
     
     # 文字別優先検索を実行
-    cross_info = find_character_positions_cross_with_priority(df, df_selected, normalized_search, include_katakana)
+    cross_info = find_character_positions_cross_with_priority(df, selected_mask, normalized_search, include_katakana)
     
     if cross_info['cross_possible'] and cross_info.get('all_positions'):
-        # マッチした駅の情報を整理（複数位置・複数駅を展開）
-        result_rows = []
+        # マッチした駅の情報を列ごとに整理（複数位置・複数駅を展開）
+        result_columns = {column: [] for column in RESULT_COLUMNS}
         
         for position_result in cross_info['all_positions']:
             position = position_result['position']
             matching_stations = position_result['matching_stations']
             
-            for char_index, (char, stations_list) in enumerate(matching_stations):
-                for station_data in stations_list:
-                    # 検索範囲を決定（絵文字付き）
-                    station_pref_cd = station_data.get('pref_cd', 0)
-                    if selected_prefecture_codes and station_pref_cd in selected_prefecture_codes:
-                        search_scope = '🔵 選択地域内'
-                    else:
-                        search_scope = '🔴 全国'
-                    
-                    # 対応文字は元の駅名から取得（actual_charがあればそれを使用）
-                    display_char = station_data.get('actual_char', char)
-                    
-                    result_rows.append({
-                        'station_name': station_data['station_name'],
-                        'prefecture': station_data['prefecture'],
-                        'operator_name': station_data['operator_name'],
-                        'route_name': station_data['route_name'],
-                        'search_char': display_char,
-                        'char_position': position + 1,  # 1ベースに変換
-                        'search_scope': search_scope
-                    })
+            for char, stations_list in matching_stations:
+                result_columns['station_name'].extend(station['station_name'] for station in stations_list)
+                result_columns['prefecture'].extend(station['prefecture'] for station in stations_list)
+                result_columns['operator_name'].extend(station['operator_name'] for station in stations_list)
+                result_columns['route_name'].extend(station['route_name'] for station in stations_list)
+                # 対応文字は元の駅名から取得（actual_charがあればそれを使用）
+                result_columns['search_char'].extend(station.get('actual_char', char) for station in stations_list)
+                result_columns['char_position'].extend([position + 1] * len(stations_list))  # 1ベースに変換
+                # 検索範囲は selected_mask から付与済みのラベルをそのまま使用
+                result_columns['search_scope'].extend(station['search_scope'] for station in stations_list)
         
-        return pd.DataFrame(result_rows)
+        result_columns['search_scope'] = pd.Categorical(result_columns['search_scope'], categories=SEARCH_SCOPE_LABELS)
+        return pd.DataFrame(result_columns)
     else:
         return pd.DataFrame()
 
@@ -493,13 +547,20 @@ def style_dataframe(df):
     """
     データフレームに選択地域の背景色スタイルと境界線スタイルを適用
     """
-    def highlight_selected_region(row):
-        if '🔵 選択地域内' in str(row.get('search_scope', '')):
-            return ['background-color: #e3f2fd; border: 2px solid #1976d2'] * len(row)  # 薄い青色 + 濃い青の境界線
+    def highlight_selected_region(data):
+        # 表全体を一度に受け取り、選択地域内の行かどうかのマスクから全セルのスタイルを一括で作成
+        if 'search_scope' in data.columns:
+            in_selected = data['search_scope'].astype(str).str.contains('🔵 選択地域内', regex=False).to_numpy(dtype=bool)
         else:
-            return ['background-color: #fff3e0; border: 2px solid #f57c00'] * len(row)  # 薄いオレンジ色 + オレンジの境界線
+            in_selected = np.zeros(len(data), dtype=bool)
+        css = np.where(
+            in_selected[:, None],
+            'background-color: #e3f2fd; border: 2px solid #1976d2',  # 薄い青色 + 濃い青の境界線
+            'background-color: #fff3e0; border: 2px solid #f57c00'   # 薄いオレンジ色 + オレンジの境界線
+        )
+        return pd.DataFrame(np.broadcast_to(css, data.shape), index=data.index, columns=data.columns)
     
-    styled_df = df.style.apply(highlight_selected_region, axis=1)
+    styled_df = df.style.apply(highlight_selected_region, axis=None)
     
     # セル間の境界線を太くするCSS
     styled_df = styled_df.set_table_styles([
@@ -619,15 +680,8 @@ def main():
     
     # データ読み込み
     if use_fast_search and uploaded_file is None:
-        # インデックス使用時は事前処理済みデータを使用
-        df = indexed_df.copy()
-        # 必要な列が不足している場合は補完
-        if 'prefecture' not in df.columns:
-            df['prefecture'] = df['pref_cd'].map(PREFECTURE_CODE_TO_NAME)
-        if 'route_name' not in df.columns:
-            df['route_name'] = "不明"
-        if 'operator_name' not in df.columns:
-            df['operator_name'] = "不明"
+        # インデックス使用時は事前処理済みデータを使用（共有データのためコピーせず参照のみ）
+        df = indexed_df
     else:
         # 通常のデータ読み込み
         if uploaded_file is not None:
@@ -641,34 +695,38 @@ def main():
     
     st.success(f"データ読み込み完了: {len(df):,} 件の駅データ")
     
-    # 検索文字列入力
-    st.subheader("1. 検索文字列入力")
-    search_input = st.text_input(
-        "検索文字列を入力してください（ひらがな・漢字対応、最大20文字）",
-        max_chars=20,
-        help="複数駅名で縦クロスワードを検索）"
-    )
-    
-    # カタカナ処理の切り替え
-    include_katakana = st.checkbox(
-        "カタカナを別文字として扱う",
-        value=False,
-        help="オン: カタカナをそのまま検索対象とする（「あ」と「ア」を別文字扱い）\nオフ: カタカナをひらがなに変換して検索（「あ」と「ア」を同じ文字扱い）"
-    )
-
-    
-    # 都道府県・地方選択
-    st.subheader("2. 地方・都道府県選択")
-    
-    # 地方区分と都道府県のオプションを取得
-    prefecture_options = get_prefecture_options()
-    
-    selected_options = st.multiselect(
-        "検索対象とする地方・都道府県を選択してください（複数選択可、未選択時は全国対象）",
-        options=prefecture_options,
-        default=[],
-        help="【地方名】を選択すると該当地方の全都道府県が対象になります。\n個別の都道府県も選択可能です。"
-    )
+    # 検索条件はフォームにまとめ、「検索実行」を押したときだけ検索する
+    # （フォーム内の入力変更や他のウィジェット操作では再検索しない）
+    with st.form("search_form"):
+        # 検索文字列入力
+        st.subheader("1. 検索文字列入力")
+        search_input = st.text_input(
+            "検索文字列を入力してください（ひらがな・漢字対応、最大20文字）",
+            max_chars=20,
+            help="複数駅名で縦クロスワードを検索）"
+        )
+        
+        # カタカナ処理の切り替え
+        include_katakana = st.checkbox(
+            "カタカナを別文字として扱う",
+            value=False,
+            help="オン: カタカナをそのまま検索対象とする（「あ」と「ア」を別文字扱い）\nオフ: カタカナをひらがなに変換して検索（「あ」と「ア」を同じ文字扱い）"
+        )
+        
+        # 都道府県・地方選択
+        st.subheader("2. 地方・都道府県選択")
+        
+        # 地方区分と都道府県のオプションを取得
+        prefecture_options = PREFECTURE_OPTIONS
+        
+        selected_options = st.multiselect(
+            "検索対象とする地方・都道府県を選択してください（複数選択可、未選択時は全国対象）",
+            options=prefecture_options,
+            default=[],
+            help="【地方名】を選択すると該当地方の全都道府県が対象になります。\n個別の都道府県も選択可能です。"
+        )
+        
+        submitted = st.form_submit_button("検索実行", type="primary")
     
     # 選択されたオプションから都道府県コードを取得
     selected_prefecture_codes = get_selected_prefecture_codes(selected_options)
@@ -677,14 +735,17 @@ def main():
         selected_pref_names = [PREFECTURE_CODE_TO_NAME[code] for code in selected_prefecture_codes if code in PREFECTURE_CODE_TO_NAME]
         st.info(f"選択中の都道府県: {', '.join(selected_pref_names)}")
     
-    # 検索実行
-    if st.button("検索実行", type="primary") or search_input or selected_options != st.session_state.get('prev_selected', []):
-        st.session_state.prev_selected = selected_options
-        
+    # 検索実行（結果はセッション状態に保持し、それ以外の再実行では表示のみ行う）
+    if submitted:
         with st.spinner('検索中...'):
             # 高速検索かどうかで処理を分岐
             if use_fast_search and uploaded_file is None:
-                results = search_and_analyze_fast(df, search_input, selected_prefecture_codes, hiragana_index, katakana_index, include_katakana)
+                # 同じ検索条件での再実行はキャッシュされた結果を使用
+                results = search_and_analyze_cached(
+                    normalize_search_string(search_input, include_katakana),
+                    selected_prefecture_codes,
+                    include_katakana
+                )
             else:
                 results = search_and_analyze(df, search_input, selected_prefecture_codes, include_katakana)
             st.session_state.search_results = results